@@ -5,16 +5,17 @@ Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
 """
 
 from abc import ABC, abstractmethod
+import functools
 import math
-import pdb
+import numbers
 import collections
 import itertools
-import tensorflow.compat.v1 as tf
+import numpy as np
 import random
 from tqdm import tqdm
 
 from instruction import *
-from primitives import Line, Point, Circle, Num
+from primitives import Primitive, Line, Point, Circle, Num
 from util import is_number, FuncInfo
 
 
@@ -26,6 +27,73 @@ CircleNF = collections.namedtuple("CircleNF", ["center", "radius"])
 # by convention, n is a unit vector located in the upper-half plane
 LineNF = collections.namedtuple("LineNF", ["n", "r"])
 
+# Stacked coordinates of several points; the point-wise helpers
+# (sqdist, coll_phi, det3, ...) evaluate elementwise on these
+PointArray = collections.namedtuple("PointArray", ["x", "y"])
+
+# Rotation by pi / 3 scaled by 1 / 2, as rows for matrix_mul
+HALF_ROTATION_60 = ((0.5 * math.cos(math.pi / 3), -0.5 * math.sin(math.pi / 3)),
+                    (0.5 * math.sin(math.pi / 3), 0.5 * math.cos(math.pi / 3)))
+
+# Cross products, dot products and squared lengths of consecutive edges
+# (B - A, C - B), (C - B, A - C), (A - C, B - A) of a triangle, stacked
+TriangleEdgeTerms = collections.namedtuple("TriangleEdgeTerms", ["sins", "coss", "sqs"])
+
+# Side lengths, squared side lengths and Conway values of a triangle
+TriangleInvariants = collections.namedtuple("TriangleInvariants", ["a", "b", "c", "a2", "b2", "c2", "Sa", "Sb", "Sc"])
+
+
+def memoize(f):
+    # Caches f on the identity of its arguments, so that e.g. the circumcenter
+    # of the same three points is only built into the graph once.
+    # Results built inside a cond branch must not be reused outside of it,
+    # so only memoize helpers that are never called from a cond branch.
+    # Keyword arguments (e.g. precomputed invariants) are not part of the key.
+    @functools.wraps(f)
+    def wrapper(self, *args, **kwargs):
+        key = (f.__name__,) + tuple(id(a) for a in args)
+        if key not in self._memo:
+            # Hold on to args so their ids cannot be recycled while cached
+            self._memo[key] = (args, f(self, *args, **kwargs))
+        return self._memo[key][1]
+    return wrapper
+
+
+def value_key(x):
+    # Structural key for (possibly unnamed) primitives: the parser builds a new
+    # Line / Circle for every mention, so ids rarely repeat but values do.
+    # Backend values (e.g. the point inside __val__) are keyed by identity.
+    if isinstance(x, (str, numbers.Number)):
+        return x
+    elif isinstance(x, Primitive):
+        return (type(x).__name__, value_key(x.val))
+    elif isinstance(x, (list, tuple)):
+        return (type(x).__name__,) + tuple(value_key(a) for a in x)
+    else:
+        return id(x)
+
+
+def memoize_by_value(f):
+    # Like memoize, but keyed on the structure of a single primitive argument
+    @functools.wraps(f)
+    def wrapper(self, x):
+        key = (f.__name__, value_key(x))
+        if key not in self._memo:
+            self._memo[key] = (x, f(self, x))
+        return self._memo[key][1]
+    return wrapper
+
+
+@functools.lru_cache(maxsize=None)
+def combination_idxs(n, k):
+    # Rows are the k-subsets of range(n), in itertools.combinations order
+    if k == 2:
+        idxs = np.stack(np.triu_indices(n, 1), axis=1)
+    else:
+        idxs = np.array(list(itertools.combinations(range(n), k)), dtype=np.int64).reshape(-1, k)
+    # Shared between callers, so keep it read-only
+    idxs.setflags(write=False)
+    return idxs
 
 
 class Optimizer(ABC):
@@ -38,6 +106,7 @@ class Optimizer(ABC):
         self.instructions = instructions
         self.ndgs = dict()
         self.goals = dict()
+        self._memo = dict()
 
         self.all_points = list()
 
@@ -45,6 +114,11 @@ class Optimizer(ABC):
         self.name2line = dict()
         self.name2circ = dict()
 
+        # Coordinates of the named points, in registration order
+        self.name2idx = dict()
+        self.pt_xs = list()
+        self.pt_ys = list()
+
         self.segments = segments
         self.seg_colors = seg_colors
         self.unnamed_points = unnamed_points
@@ -64,6 +138,7 @@ class Optimizer(ABC):
         super().__init__()
 
     def preprocess(self):
+        self._memo = dict()
         process_instr_iter = self.instructions if self.verbosity < 0 else tqdm(self.instructions, desc="Processing instructions...")
 
         # for i in self.instructions:
@@ -72,27 +147,47 @@ class Optimizer(ABC):
             self.process_instruction(i)
 
         # After we've processed the instructions, process all the unnamed things
-        self.unnamed_points = [self.lookup_pt(p) for p in self.unnamed_points]
-        self.unnamed_lines = [self.line2nf(l) for l in self.unnamed_lines]
-        self.unnamed_circles = [self.circ2nf(c) for c in self.unnamed_circles]
+        self.unnamed_points = [self.lookup_pt(p) for p in self.dedup(self.unnamed_points)]
+        self.unnamed_lines = [self.line2nf(l) for l in self.dedup(self.unnamed_lines)]
+        self.unnamed_circles = [self.circ2nf(c) for c in self.dedup(self.unnamed_circles)]
+        self.dedup_segments()
         self.segments = [(self.lookup_pt(a), self.lookup_pt(b)) for (a, b) in self.segments]
 
-    def process_instruction(self, i):
+    def dedup(self, objs):
+        # The same unnamed object may be mentioned many times; keep the first
+        seen = set()
+        uniq = list()
+        for obj in objs:
+            key = str(obj)
+            if key not in seen:
+                seen.add(key)
+                uniq.append(obj)
+        return uniq
+
+    def dedup_segments(self):
+        seen = set()
+        segments, seg_colors = list(), list()
+        for (a, b), color in zip(self.segments, self.seg_colors):
+            key = frozenset([str(a), str(b)])
+            if key not in seen:
+                seen.add(key)
+                segments.append((a, b))
+                seg_colors.append(color)
+        self.segments, self.seg_colors = segments, seg_colors
+
+    _INSTRUCTION_HANDLERS = {
+        Sample: lambda self, i: self.sample(i),
+        Compute: lambda self, i: self.compute(i),
+        Parameterize: lambda self, i: self.parameterize(i),
+        Assert: lambda self, i: self.add(i),
+        AssertNDG: lambda self, i: self.addNDG(i),
+        Eval: lambda self, i: self.eval_cons(i),
+    }
 
-        if isinstance(i, Sample):
-            self.sample(i)
-        elif isinstance(i, Compute):
-            self.compute(i)
-        elif isinstance(i, Parameterize):
-            self.parameterize(i)
-        elif isinstance(i, Assert):
-            self.add(i)
-        elif isinstance(i, AssertNDG):
-            self.addNDG(i)
-        elif isinstance(i, Eval):
-            self.eval_cons(i)
-        else:
+    def process_instruction(self, i):
+        if type(i) not in self._INSTRUCTION_HANDLERS:
             raise NotImplementedError("FIXME: Finish process_instruction")
+        self._INSTRUCTION_HANDLERS[type(i)](self, i)
 
     @abstractmethod
     def get_point(self, x, y):
@@ -179,6 +274,18 @@ class Optimizer(ABC):
             p_vals.append(self.lookup_pt(p))
         return p_vals
 
+    def named_pts(self):
+        return PointArray(x=self.stack(self.pt_xs), y=self.stack(self.pt_ys))
+
+    def stack_pts(self, Ps):
+        return PointArray(x=self.stack([P.x for P in Ps]), y=self.stack([P.y for P in Ps]))
+
+    def gather_pts(self, Ps, idxs):
+        # Returns one PointArray per column of idxs, e.g. the A, B, C of every triple
+        if not isinstance(Ps, PointArray):
+            Ps = self.stack_pts(Ps)
+        return [PointArray(x=self.gather(Ps.x, col), y=self.gather(Ps.y, col)) for col in idxs.T]
+
     def eval_num(self, n_info):
         n_val = n_info.val
         if not isinstance(n_val, tuple) and is_number(n_val):
@@ -346,34 +453,63 @@ class Optimizer(ABC):
     def logical_or(self, x, y):
         pass
 
+    @abstractmethod
+    def logical_and(self, x, y):
+        pass
+
     @abstractmethod
     def abs(self, x):
         pass
 
+    @abstractmethod
+    def sign(self, x):
+        pass
+
     @abstractmethod
     def exp(self, x):
         pass
 
-    def softmax(self, xs):
-        exps = [self.exp(x) for x in xs]
-        sum_exps = self.sum(exps)
-        return [e / sum_exps for e in exps]
+    @abstractmethod
+    def stack(self, xs):
+        pass
+
+    @abstractmethod
+    def gather(self, xs, idxs):
+        pass
+
+    @abstractmethod
+    def reduce_max(self, xs):
+        pass
+
+    @abstractmethod
+    def reduce_min(self, xs):
+        pass
+
+    def shifted_exps(self, xs):
+        # exp(x - max(xs)) keeps the largest term at 1 so no term can overflow
+        x_max = functools.reduce(self.max, xs)
+        return [self.exp(x - x_max) for x in xs]
 
     #####################
     ## Sample
     ####################
 
+    _SAMPLE_HANDLERS = {
+        "acute-iso-tri": lambda self, ps, s_args: self.sample_triangle(ps, iso=s_args[0], acute=True),
+        "acute-tri": lambda self, ps, s_args: self.sample_triangle(ps, acute=True),
+        "equi-tri": lambda self, ps, s_args: self.sample_triangle(ps, equi=True),
+        "iso-tri": lambda self, ps, s_args: self.sample_triangle(ps, iso=s_args[0]),
+        "polygon": lambda self, ps, s_args: self.sample_polygon(ps),
+        "right-tri": lambda self, ps, s_args: self.sample_triangle(ps, right=s_args[0]),
+        "triangle": lambda self, ps, s_args: self.sample_triangle(ps),
+    }
+
     def sample(self, i):
         s_method = i.sampler
         s_args = i.args
-        if s_method == "acute-iso-tri": self.sample_triangle(i.points, iso=s_args[0], acute=True)
-        elif s_method == "acute-tri": self.sample_triangle(i.points, acute=True)
-        elif s_method == "equi-tri": self.sample_triangle(i.points, equi=True)
-        elif s_method == "iso-tri": self.sample_triangle(i.points, iso=s_args[0])
-        elif s_method == "polygon": self.sample_polygon(i.points)
-        elif s_method == "right-tri": self.sample_triangle(i.points, right=s_args[0])
-        elif s_method == "triangle": self.sample_triangle(i.points)
-        else: raise NotImplementedError(f"[sample] NYI: Sampling method {s_method}")
+        if s_method not in self._SAMPLE_HANDLERS:
+            raise NotImplementedError(f"[sample] NYI: Sampling method {s_method}")
+        self._SAMPLE_HANDLERS[s_method](self, i.points, s_args)
 
     def sample_uniform(self, p, lo=-1.0, hi=1.0, save_name=True):
         P   = self.get_point(x=self.mkvar(str(p)+"x", lo=lo, hi=hi),
@@ -389,7 +525,8 @@ class Optimizer(ABC):
 
         angle_zs = [self.mkvar(name=f"polygon_angle_zs_{i}", lo=-2.0, hi=2.0) for i in range(len(ps))]
         multiplicand = ((len(ps) - 2) / len(ps)) * math.pi
-        angles = [multiplicand + (math.pi / 3) * self.tanh(0.2 * az) for az in angle_zs]
+        max_angle_offset = math.pi / 3
+        angles = [multiplicand + max_angle_offset * self.tanh(0.2 * az) for az in angle_zs]
 
         scale_zs = [self.mkvar(name=f"polygon_scale_zs_{i}", lo=-2.0, hi=2.0) for i in range(len(ps))]
         scales = [0.5 * self.tanh(0.2 * sz) for sz in scale_zs]
@@ -401,8 +538,9 @@ class Optimizer(ABC):
         for i in range(2, len(ps) + 1):
             # print(f"sampling polygon point: {i}")
             A, B = Ps[-2:]
-            X = B + self.rotate_counterclockwise(-angles[i-1], A - B)
-            P = B + (X - B).smul(s * (1 + scales[i-1]) / self.dist(X, B))
+            # X - B is A - B rotated about B, so |X - B| = |A - B|
+            BX = self.rotate_counterclockwise(-angles[i-1], A - B)
+            P = B + BX.smul(s * (1 + scales[i-1]) / self.dist(A, B))
             # Ps.append(P)
             Ps.append(self.simplify(P, method="trig"))
 
@@ -486,52 +624,52 @@ class Optimizer(ABC):
     ## Compute
     ####################
 
+    _COMPUTE_HANDLERS = {
+        Point: lambda self, name, comp: self.register_pt(name, self.lookup_pt(comp, str(name))),
+        Line: lambda self, name, comp: self.register_line(name, self.line2nf(comp)),
+        Circle: lambda self, name, comp: self.register_circ(name, self.circ2nf(comp)),
+    }
+
     def compute(self, i):
         obj_name = i.obj_name
         c_method = i.computation.val[0]
-        c_args = i.computation.val
-        if isinstance(i.computation, Point):
-            P = self.lookup_pt(i.computation, str(obj_name))
-            self.register_pt(obj_name, P)
-
-        elif isinstance(i.computation, Line):
-            L = self.line2nf(i.computation)
-            self.register_line(obj_name, L)
-        elif isinstance(i.computation, Circle):
-            C = self.circ2nf(i.computation)
-            self.register_circ(obj_name, C)
-        else:
+        if type(i.computation) not in self._COMPUTE_HANDLERS:
             raise NotImplementedError(f"[compute] NYI: {c_method} not supported")
+        self._COMPUTE_HANDLERS[type(i.computation)](self, obj_name, i.computation)
 
 
     #####################
     ## Parameterize
     ####################
 
+    _PARAM_HANDLERS = {
+        "coords": lambda self, p, p_args: self.parameterize_coords(p),
+        "in-poly": lambda self, p, p_args: self.parameterize_in_poly(p, p_args[1]),
+        "on-circ": lambda self, p, p_args: self.parameterize_on_circ(p, p_args[1]),
+        "on-line": lambda self, p, p_args: self.parameterize_on_line(p, p_args[1]),
+        "on-ray": lambda self, p, p_args: self.parameterize_on_ray(p, p_args[1]),
+        "on-ray-opp": lambda self, p, p_args: self.parameterize_on_ray_opp(p, p_args[1]),
+        "on-seg": lambda self, p, p_args: self.parameterize_on_seg(p, p_args[1]),
+        "on-minor-arc": lambda self, p, p_args: self.parameterize_on_minor_arc(p, p_args[1]),
+        "on-major-arc": lambda self, p, p_args: self.parameterize_on_major_arc(p, p_args[1]),
+        "line": lambda self, p, p_args: self.parameterize_line(p),
+        "through-l": lambda self, p, p_args: self.parameterize_line_through(p, p_args[1]),
+        "tangent-lc": lambda self, p, p_args: self.parameterize_line_tangentC(p, p_args[1]),
+        "tangent-cc": lambda self, p, p_args: self.parameterize_circ_tangentC(p, p_args[1]),
+        "tangent-cl": lambda self, p, p_args: self.parameterize_circ_tangentL(p, p_args[1]),
+        "through-c": lambda self, p, p_args: self.parameterize_circ_through(p, p_args[1]),
+        "circle": lambda self, p, p_args: self.parameterize_circ(p),
+        "origin": lambda self, p, p_args: self.parameterize_circ_centered_at(p, p_args[1]),
+        "radius": lambda self, p, p_args: self.parameterize_circ_with_radius(p, p_args[1]),
+    }
+
     def parameterize(self, i):
         p_name = i.obj_name
         p_method = i.parameterization[0]
         p_args = i.parameterization
-        param_method = i.parameterization
-        if p_method == "coords": self.parameterize_coords(p_name)
-        elif p_method == "in-poly": self.parameterize_in_poly(p_name, p_args[1])
-        elif p_method == "on-circ": self.parameterize_on_circ(p_name, p_args[1])
-        elif p_method == "on-line": self.parameterize_on_line(p_name, p_args[1])
-        elif p_method == "on-ray": self.parameterize_on_ray(p_name, p_args[1])
-        elif p_method == "on-ray-opp": self.parameterize_on_ray_opp(p_name, p_args[1])
-        elif p_method == "on-seg": self.parameterize_on_seg(p_name, p_args[1])
-        elif p_method == "on-minor-arc": self.parameterize_on_minor_arc(p_name, p_args[1])
-        elif p_method == "on-major-arc": self.parameterize_on_major_arc(p_name, p_args[1])
-        elif p_method == "line": self.parameterize_line(p_name)
-        elif p_method == "through-l": self.parameterize_line_through(p_name, p_args[1])
-        elif p_method == "tangent-lc": self.parameterize_line_tangentC(p_name, p_args[1])
-        elif p_method == "tangent-cc": self.parameterize_circ_tangentC(p_name, p_args[1])
-        elif p_method == "tangent-cl": self.parameterize_circ_tangentL(p_name, p_args[1])
-        elif p_method == "through-c": self.parameterize_circ_through(p_name, p_args[1])
-        elif p_method == "circle": self.parameterize_circ(p_name)
-        elif p_method == "origin": self.parameterize_circ_centered_at(p_name, p_args[1])
-        elif p_method == "radius": self.parameterize_circ_with_radius(p_name, p_args[1])
-        else: raise NotImplementedError(f"FIXME: Finish parameterize: {i}")
+        if p_method not in self._PARAM_HANDLERS:
+            raise NotImplementedError(f"FIXME: Finish parameterize: {i}")
+        self._PARAM_HANDLERS[p_method](self, p_name, p_args)
 
     def parameterize_coords(self, p):
         return self.sample_uniform(p)
@@ -669,7 +807,7 @@ class Optimizer(ABC):
         [circ] = p_args
         O, r = self.circ2nf(circ)
         rot = self.mkvar(name=f"{p}_rot")
-        theta = rot * 2 * self.const(math.pi)
+        theta = rot * (2 * math.pi)
         X = self.get_point(x=O.x + r * self.cos(theta), y=O.y + r * self.sin(theta))
         return self.register_pt(p, X, save_name=save_name)
         # self.unnamed_circles.append((O, r))
@@ -731,10 +869,11 @@ class Optimizer(ABC):
     def parameterize_in_poly(self, p, ps):
         Ps = self.lookup_pts(ps)
         zs = [self.mkvar(name=f"{p}_in_poly_{poly_p}") for poly_p in ps]
-        ws = self.softmax(zs)
-        Px = self.sum([P.x * w for (P, w) in zip(Ps, ws)])
-        Py = self.sum([P.y * w for (P, w) in zip(Ps, ws)])
-        P = self.get_point(Px, Py)
+        # Softmax-weighted average of Ps, normalized once after summing
+        exps = self.shifted_exps(zs)
+        Px = self.sum([P.x * e for (P, e) in zip(Ps, exps)])
+        Py = self.sum([P.y * e for (P, e) in zip(Ps, exps)])
+        P = self.get_point(Px, Py).sdiv(self.sum(exps))
         return self.register_pt(p, P)
 
     #####################
@@ -765,7 +904,7 @@ class Optimizer(ABC):
         vals = self.assertion_vals(pred, args)
 
         # We only have to violate one!
-        ndg_val = tf.reduce_max(vals) # Note how we reduce MAX because we are trying to make non-zero
+        ndg_val = self.reduce_max(vals) # Note how we reduce MAX because we are trying to make non-zero
         ndg_str = f"not_{pred}_{'_'.join([str(a) for a in args])}"
         self.register_ndg(ndg_str, ndg_val, weight=1.0)
 
@@ -786,210 +925,312 @@ class Optimizer(ABC):
         g_str = f"{pred}_{'_'.join([str(a) for a in args])}"
         if negate:
             g_str = f"not_{g_str}"
-            vals = [tf.reduce_max(vals)]
+            vals = [self.reduce_max(vals)]
 
         for i, val in enumerate(vals):
             goal_str = g_str if len(vals) == 1 else f"{g_str}_{i}"
             self.register_goal(goal_str, val, negate)
 
     def assertion_vals(self, pred, args):
-        if pred == "amidp-opp":
-            M, B, C, A = self.lookup_pts(args)
-            return [self.dist(M, self.amidp_opp(B, C, A))]
-        elif pred == "amidp-same":
-            M, B, C, A = self.lookup_pts(args)
-            return [self.dist(M, self.amidp_same(B, C, A))]
-        # elif pred == "between": return self.between_gap(*self.lookup_pts(args))
-        elif pred == "circumcenter":
-            O, A, B, C = self.lookup_pts(args)
-            # self.unnamed_circles.append((O, self.dist(O, A)))
-            return [self.dist(O, self.circumcenter(A, B, C))]
-        elif pred == "coll":
-            coll_args = self.lookup_pts(args)
-            diffs = [self.coll_phi(A, B, C) for A, B, C in itertools.combinations(coll_args, 3)]
-            # for i in range(len(coll_args)-1):
-                # self.segments.append((coll_args[i], coll_args[i+1]))
-            return diffs
-        elif pred == "concur":
-            l1, l2, l3 = args
-            inter_12 = Point(FuncInfo("inter-ll", [l1, l2]))
-            return self.assertion_vals("on-line", [inter_12, l3])
-        elif pred == "cong":
-            A, B, C, D = self.lookup_pts(args)
-            # if A in [C, D]: self.unnamed_circles.append((A, self.dist(A, B)))
-            # elif B in [C, D]: self.unnamed_circles.append((B, self.dist(A, B)))
-            return [self.cong_diff(A, B, C, D)]
-        elif pred == "con-tri":
-            [A, B, C, P, Q, R] = self.lookup_pts(args)
-            # self.segments.extend([(A, B), (B, C), (C, A), (P, Q), (Q, R), (R, P)])
-            return [self.eqangle6_diff(A, B, C, P, Q, R),
-                    self.eqangle6_diff(B, C, A, Q, R, P),
-                    self.eqangle6_diff(C, A, B, R, P, Q),
-                    self.cong_diff(A, B, P, Q),
-                    self.cong_diff(A, C, P, R),
-                    self.cong_diff(B, C, Q, R)]
-        elif pred == "cycl":
-            cycl_args = self.lookup_pts(args)
-            assert(len(cycl_args) > 3)
-            O = self.circumcenter(*cycl_args[:3])
-            diffs = [self.eqangle6_diff(A, B, D, A, C, D) for A, B, C, D in itertools.combinations(cycl_args, 4)]
-            # self.unnamed_circles.append((O, self.dist(O, cycl_args[0])))
-            return diffs
-        elif pred == "dist-lt":
-            X, Y, A, B = self.lookup_pts(args)
-            return [self.max(self.const(0.0), self.dist(X, Y) - dist(A, B))]
-        elif pred == "dist-gt":
-            X, Y, A, B = self.lookup_pts(args)
-            return [self.max(self.const(0.0), self.dist(A, B) - self.dist(X, Y))]
-        elif pred == "eq-n":
-            n1, n2 = [self.eval_num(n) for n in args]
-            return [self.abs(n1 - n2)]
-        elif pred == "eq-p":
-            A, B = self.lookup_pts(args)
-            return [self.dist(A, B)]
-        elif pred == "eq-l":
+        if pred not in self._PRED_HANDLERS:
+            raise NotImplementedError(f"[assertion_vals] NYI: {pred}")
+        return self._PRED_HANDLERS[pred](self, args)
+
+    def _av_amidp_opp(self, args):
+        M, B, C, A = self.lookup_pts(args)
+        return [self.dist(M, self.amidp_opp(B, C, A))]
+
+    def _av_amidp_same(self, args):
+        M, B, C, A = self.lookup_pts(args)
+        return [self.dist(M, self.amidp_same(B, C, A))]
+
+    # def _av_between(self, args):
+        # return self.between_gap(*self.lookup_pts(args))
+
+    def _av_circumcenter(self, args):
+        O, A, B, C = self.lookup_pts(args)
+        # self.unnamed_circles.append((O, self.dist(O, A)))
+        return [self.dist(O, self.circumcenter(A, B, C))]
+
+    def _av_coll(self, args):
+        coll_args = self.lookup_pts(args)
+        if len(coll_args) == 3:
+            return [self.coll_phi(*coll_args)]
+        # for i in range(len(coll_args)-1):
+            # self.segments.append((coll_args[i], coll_args[i+1]))
+        idxs = combination_idxs(len(coll_args), 3)
+        return [self.coll_phi(*self.gather_pts(coll_args, idxs))]
+
+    def _av_concur(self, args):
+        l1, l2, l3 = args
+        inter_12 = Point(FuncInfo("inter-ll", [l1, l2]))
+        return self.assertion_vals("on-line", [inter_12, l3])
+
+    def _av_cong(self, args):
+        A, B, C, D = self.lookup_pts(args)
+        # if A in [C, D]: self.unnamed_circles.append((A, self.dist(A, B)))
+        # elif B in [C, D]: self.unnamed_circles.append((B, self.dist(A, B)))
+        return [self.cong_diff(A, B, C, D)]
+
+    def _av_con_tri(self, args):
+        [A, B, C, P, Q, R] = self.lookup_pts(args)
+        # self.segments.extend([(A, B), (B, C), (C, A), (P, Q), (Q, R), (R, P)])
+        abc = self.triangle_edge_terms(A, B, C)
+        pqr = self.triangle_edge_terms(P, Q, R)
+        return [self.eqangle_diff(abc.sins, abc.coss, pqr.sins, pqr.coss),
+                abc.sqs - pqr.sqs]
+
+    def _av_cycl(self, args):
+        cycl_args = self.lookup_pts(args)
+        assert(len(cycl_args) > 3)
+        if len(cycl_args) == 4:
+            return [self.cycl_diff(*cycl_args)]
+        idxs = combination_idxs(len(cycl_args), 4)
+        # cycl_diff(A, B, C, D) = eqangle6_diff(A, B, D, A, C, D)
+        return [self.eqangle6_diff_batch(cycl_args, idxs[:, [0, 1, 3, 0, 2, 3]])]
+
+    def _av_dist_lt(self, args):
+        X, Y, A, B = self.lookup_pts(args)
+        return [self.max(self.const(0.0), self.dist(X, Y) - self.dist(A, B))]
+
+    def _av_dist_gt(self, args):
+        X, Y, A, B = self.lookup_pts(args)
+        return [self.max(self.const(0.0), self.dist(A, B) - self.dist(X, Y))]
+
+    def _av_eq_n(self, args):
+        n1, n2 = [self.eval_num(n) for n in args]
+        return [self.abs(n1 - n2)]
+
+    def _av_eq_p(self, args):
+        A, B = self.lookup_pts(args)
+        return [self.dist(A, B)]
+
+    def _av_eq_l(self, args):
+        l1, l2 = args
+        lnf1, lnf2 = self.line2nf(l1), self.line2nf(l2)
+        n1, r1 = lnf1
+        n2, r2 = lnf2
+        return [self.dist(n1, n2), self.abs(r1 - r2)]
+
+    def _av_gte(self, args):
+        n1, n2 = [self.eval_num(n) for n in args]
+        return [self.max(self.const(0.0), n2 - n1)]
+
+    def _av_gt(self, args):
+        # n1 > n2
+        n1, n2 = [self.eval_num(n) for n in args]
+        return [self.max(self.const(0.0), (n2 + 1e-1) - n1)]
+
+    def _av_lte(self, args):
+        n1, n2 = [self.eval_num(n) for n in args]
+        return [self.max(self.const(0.0), n1 - n2)]
+
+    def _av_lt(self, args):
+        # n1 < n2
+        n1, n2 = [self.eval_num(n) for n in args]
+        return [self.max(self.const(0.0), (n1 + 1e-1) - n2)]
+
+    def _av_eq_angle(self, args):
+        return [self.eqangle8_diff(*self.lookup_pts(args))]
+
+    # def _av_eqoangle(self, args):
+        # A, B, C, P, Q, R = self.lookup_pts(args)
+        # return [self.angle(A, B, C) - self.angle(P, Q, R)]
+
+    def _av_eq_ratio(self, args):
+        return [self.eqratio_diff(*self.lookup_pts(args))]
+
+    def _av_foot(self, args):
+        f, x, l = args
+        F, X = self.lookup_pts([f, x])
+        lnf = self.line2nf(l)
+        A, B = self.lnf2pp(lnf)
+        return [self.coll_phi(F, A, B), self.perp_phi(F, X, A, B)]
+
+    def _av_i_bisector(self, args):
+        X, B, A, C = self.lookup_pts(args)
+        # self.segments.extend([(B, A), (A, X), (A, C)])
+        return [self.eqangle8_diff(B, A, A, X, X, A, A, C)]
+
+    def _av_incenter(self, args):
+        I, A, B, C = self.lookup_pts(args)
+        return [self.dist(I, self.incenter(A, B, C))]
+
+    def _av_in_poly(self, args):
+        return self.in_poly_phis(*self.lookup_pts(args))
+
+    def _av_inter_ll(self, args):
+        X, A, B, C, D = self.lookup_pts(args)
+        return [self.coll_phi(X, A, B), self.coll_phi(X, C, D)]
+
+    def _av_isogonal_conj(self, args):
+        X, Y, A, B, C = self.lookup_pts(args)
+        return [self.dist(X, self.isogonal_conj(Y, A, B, C))]
+
+    def _av_midp(self, args):
+        M, A, B = self.lookup_pts(args)
+        return [self.dist(M, self.midp(A, B))]
+
+    def _av_on_circ(self, args):
+        X, C = args
+        [X] = self.lookup_pts([X])
+        (O, r) = self.circ2nf(C)
+        return [self.dist(O, X) - r]
+
+    def _av_on_line(self, args):
+        [X, l] = args
+        [X] = self.lookup_pts([X])
+        lp1, lp2 = self.line2twoPts(l)
+        return [self.coll_phi(X, lp1, lp2)]
+
+    def _av_on_ray(self, args):
+        return [self.coll_phi(*self.lookup_pts(args))] + self.onray_gap(*self.lookup_pts(args))
+
+    def _av_on_seg(self, args):
+        return [self.coll_phi(*self.lookup_pts(args))] + self.between_gap(*self.lookup_pts(args))
+
+    def _av_opp_sides(self, args):
+        a, b, l = args
+        A, B = self.lookup_pts([a, b])
+        lnf = self.line2nf(l)
+        X, Y = self.lnf2pp(lnf)
+        return [self.max(self.const(0.0), self.side_score_prod(A, B, X, Y))]
+
+    def _av_orthocenter(self, args):
+        H, A, B, C = self.lookup_pts(args)
+        return [self.dist(H, self.orthocenter(A, B, C))]
+
+    def _av_perp(self, args):
+        if len(args) == 4: # four points
+            return [self.perp_phi(*self.lookup_pts(args))]
+        else: # two lines
             l1, l2 = args
-            lnf1, lnf2 = self.line2nf(l1), self.line2nf(l2)
-            n1, r1 = lnf1
-            n2, r2 = lnf2
-            return [self.dist(n1, n2), self.abs(r1 - r2)]
-        elif pred == "gte":
-            n1, n2 = [self.eval_num(n) for n in args]
-            return [self.max(self.const(0.0), n2 - n1)]
-        elif pred == "gt":
-            # n1 > n2
-            n1, n2 = [self.eval_num(n) for n in args]
-            return [self.max(self.const(0.0), (n2 + 1e-1) - n1)]
-        elif pred == "lte":
-            n1, n2 = [self.eval_num(n) for n in args]
-            return [self.max(self.const(0.0), n1 - n2)]
-        elif pred == "lt":
-            # n1 < n2
-            n1, n2 = [self.eval_num(n) for n in args]
-            return [self.max(self.const(0.0), (n1 + 1e-1) - n2)]
-        elif pred == "eq-angle": return [self.eqangle8_diff(*self.lookup_pts(args))]
-        # elif pred == "eqoangle":
-            # A, B, C, P, Q, R = self.lookup_pts(args)
-            # return [self.angle(A, B, C) - self.angle(P, Q, R)]
-        elif pred == "eq-ratio": return [self.eqratio_diff(*self.lookup_pts(args))]
-        elif pred == "foot":
-            f, x, l = args
-            F, X = self.lookup_pts([f, x])
-            lnf = self.line2nf(l)
-            A, B = self.lnf2pp(lnf)
-            return [self.coll_phi(F, A, B), self.perp_phi(F, X, A, B)]
-        elif pred == "i-bisector":
-            X, B, A, C = self.lookup_pts(args)
-            # self.segments.extend([(B, A), (A, X), (A, C)])
-            return [self.eqangle8_diff(B, A, A, X, X, A, A, C)]
-        elif pred == "incenter":
-            I, A, B, C = self.lookup_pts(args)
-            return [self.dist(I, self.incenter(A, B, C))]
-        elif pred == "in-poly": return self.in_poly_phis(*self.lookup_pts(args))
-        elif pred == "inter-ll":
-            X, A, B, C, D = self.lookup_pts(args)
-            return [self.coll_phi(X, A, B), self.coll_phi(X, C, D)]
-        elif pred == "isogonal-conj":
-            X, Y, A, B, C = self.lookup_pts(args)
-            return [self.dist(X, self.isogonal_conj(Y, A, B, C))]
-        elif pred == "midp":
-            M, A, B = self.lookup_pts(args)
-            return [self.dist(M, self.midp(A, B))]
-        elif pred == "on-circ":
-            X, C = args
-            [X] = self.lookup_pts([X])
-            (O, r) = self.circ2nf(C)
-            return [self.dist(O, X) - r]
-        elif pred == "on-line":
-            [X, l] = args
-            [X] = self.lookup_pts([X])
-            lp1, lp2 = self.line2twoPts(l)
-            return [self.coll_phi(X, lp1, lp2)]
-        elif pred == "on-ray": return [self.coll_phi(*self.lookup_pts(args))] + self.onray_gap(*self.lookup_pts(args))
-        elif pred == "on-seg": return [self.coll_phi(*self.lookup_pts(args))] + self.between_gap(*self.lookup_pts(args))
-        elif pred == "opp-sides":
-            a, b, l = args
-            A, B = self.lookup_pts([a, b])
-            lnf = self.line2nf(l)
-            X, Y = self.lnf2pp(lnf)
-            return [self.max(self.const(0.0), self.side_score_prod(A, B, X, Y))]
-        elif pred == "orthocenter":
-            H, A, B, C = self.lookup_pts(args)
-            return [self.dist(H, self.orthocenter(A, B, C))]
-        elif pred == "perp":
-            if len(args) == 4: # four points
-                return [self.perp_phi(*self.lookup_pts(args))]
-            else: # two lines
-                l1, l2 = args
-                P1, P2 = self.line2twoPts(l1)
-                P3, P4 = self.line2twoPts(l2)
-                return [self.perp_phi(P1, P2, P3, P4)]
-        elif pred == "para":
-            if len(args) == 4: # four points
-                return [self.para_phi(*self.lookup_pts(args))]
-            else: # two lines
-                l1, l2 = args
-                P1, P2 = self.line2twoPts(l1)
-                P3, P4 = self.line2twoPts(l2)
-                return [self.para_phi(P1, P2, P3, P4)]
-        elif pred == "reflect-pl":
-            X, Y, A, B = self.lookup_pts(args)
-            return [self.perp_phi(X, Y, A, B), self.cong_diff(A, X, A, Y)]
-        elif pred == "right":
-            A, B, C = self.lookup_pts(args)
-            return [self.right_phi(A, B, C)]
-        elif pred == "right-tri":
-            A, B, C = self.lookup_pts(args)
-            return [tf.reduce_min([self.right_phi(A, B, C),
-                                   self.right_phi(B, A, C),
-                                   self.right_phi(B, C, A)])]
-        elif pred == "same-side":
-            a, b, l = args
-            A, B = self.lookup_pts([a, b])
-            lnf = self.line2nf(l)
-            X, Y = self.lnf2pp(lnf)
-            return [self.max(self.const(0.0), -self.side_score_prod(A, B, X, Y))]
-        elif pred == "sim-tri":
-            [A, B, C, P, Q, R] = self.lookup_pts(args)
-            # self.segments.extend([(A, B), (B, C), (C, A), (P, Q), (Q, R), (R, P)])
-            # this is *too* easy to optimize, eqangle properties don't end up holding
-            # return [eqratio_diff(A, B, B, C, P, Q, Q, R), eqratio_diff(B, C, C, A, Q, R, R, P), eqratio_diff(C, A, A, B, R, P, P, Q)]
-            return [self.eqangle6_diff(A, B, C, P, Q, R), self.eqangle6_diff(B, C, A, Q, R, P), self.eqangle6_diff(C, A, B, R, P, Q)]
-        elif pred == "tangent-cc":
-            # https://mathworld.wolfram.com/TangentCircles.html
-            # Could distinguish b/w internally and externally if desired
-            c1, c2 = args
-            cnf1 ,cnf2 = self.circ2nf(c1), self.circ2nf(c2)
-            (x1, y1) = cnf1.center
-            (x2, y2) = cnf2.center
-            r1, r2 = cnf1.radius, cnf2.radius
-            lhs = (x1 - x2) ** 2 + (y1 - y2) ** 2
-            rhs_1 = (r1 - r2) ** 2
-            rhs_2 = (r1 + r2) ** 2
-            return [tf.reduce_min([self.abs(lhs - rhs_1), self.abs(lhs - rhs_2)])]
-        elif pred == "tangent-lc":
-            l, c = args
-            inter_point = Point(FuncInfo("inter-lc", [l, c, Root("arbitrary", list())]))
-            return self.assertion_vals("tangent-at-lc", [inter_point, l, c])
-        elif pred == "tangent-at-cc":
-            p, c1, c2 = args
-            c1_center = Point(FuncInfo("origin", [c1]))
-            c2_center = Point(FuncInfo("origin", [c2]))
-
-            p_on_c1 = self.assertion_vals("on-circ", [p, c1])
-            p_on_c2 = self.assertion_vals("on-circ", [p, c2])
-            tangency = self.assertion_vals("coll", [p, c1_center, c2_center])
-            return p_on_c1 + p_on_c2 + tangency
-        elif pred == "tangent-at-lc":
-            p, l, c = args
-            circ_center = Point(FuncInfo("origin", [c]))
-            circ_center_to_p = Line(FuncInfo("connecting", [circ_center, p]))
-
-            p_on_line = self.assertion_vals("on-line", [p, l])
-            p_on_circ = self.assertion_vals("on-circ", [p, c])
-            tangency = self.assertion_vals("perp", [l, circ_center_to_p])
-            return p_on_line + p_on_circ + tangency
-        else: raise NotImplementedError(f"[assertion_vals] NYI: {pred}")
+            P1, P2 = self.line2twoPts(l1)
+            P3, P4 = self.line2twoPts(l2)
+            return [self.perp_phi(P1, P2, P3, P4)]
+
+    def _av_para(self, args):
+        if len(args) == 4: # four points
+            return [self.para_phi(*self.lookup_pts(args))]
+        else: # two lines
+            l1, l2 = args
+            P1, P2 = self.line2twoPts(l1)
+            P3, P4 = self.line2twoPts(l2)
+            return [self.para_phi(P1, P2, P3, P4)]
+
+    def _av_reflect_pl(self, args):
+        X, Y, A, B = self.lookup_pts(args)
+        return [self.perp_phi(X, Y, A, B), self.cong_diff(A, X, A, Y)]
+
+    def _av_right(self, args):
+        A, B, C = self.lookup_pts(args)
+        return [self.right_phi(A, B, C)]
+
+    def _av_right_tri(self, args):
+        A, B, C = self.lookup_pts(args)
+        return [self.reduce_min([self.right_phi(A, B, C),
+                               self.right_phi(B, A, C),
+                               self.right_phi(B, C, A)])]
+
+    def _av_same_side(self, args):
+        a, b, l = args
+        A, B = self.lookup_pts([a, b])
+        lnf = self.line2nf(l)
+        X, Y = self.lnf2pp(lnf)
+        return [self.max(self.const(0.0), -self.side_score_prod(A, B, X, Y))]
+
+    def _av_sim_tri(self, args):
+        [A, B, C, P, Q, R] = self.lookup_pts(args)
+        # self.segments.extend([(A, B), (B, C), (C, A), (P, Q), (Q, R), (R, P)])
+        # this is *too* easy to optimize, eqangle properties don't end up holding
+        # return [eqratio_diff(A, B, B, C, P, Q, Q, R), eqratio_diff(B, C, C, A, Q, R, R, P), eqratio_diff(C, A, A, B, R, P, P, Q)]
+        abc = self.triangle_edge_terms(A, B, C)
+        pqr = self.triangle_edge_terms(P, Q, R)
+        return [self.eqangle_diff(abc.sins, abc.coss, pqr.sins, pqr.coss)]
+
+    def _av_tangent_cc(self, args):
+        # https://mathworld.wolfram.com/TangentCircles.html
+        # Could distinguish b/w internally and externally if desired
+        c1, c2 = args
+        cnf1 ,cnf2 = self.circ2nf(c1), self.circ2nf(c2)
+        (x1, y1) = cnf1.center
+        (x2, y2) = cnf2.center
+        r1, r2 = cnf1.radius, cnf2.radius
+        lhs = (x1 - x2) ** 2 + (y1 - y2) ** 2
+        rhs_1 = (r1 - r2) ** 2
+        rhs_2 = (r1 + r2) ** 2
+        return [self.reduce_min([self.abs(lhs - rhs_1), self.abs(lhs - rhs_2)])]
+
+    def _av_tangent_lc(self, args):
+        l, c = args
+        inter_point = Point(FuncInfo("inter-lc", [l, c, Root("arbitrary", list())]))
+        return self.assertion_vals("tangent-at-lc", [inter_point, l, c])
+
+    def _av_tangent_at_cc(self, args):
+        p, c1, c2 = args
+        c1_center = Point(FuncInfo("origin", [c1]))
+        c2_center = Point(FuncInfo("origin", [c2]))
+
+        p_on_c1 = self.assertion_vals("on-circ", [p, c1])
+        p_on_c2 = self.assertion_vals("on-circ", [p, c2])
+        tangency = self.assertion_vals("coll", [p, c1_center, c2_center])
+        return p_on_c1 + p_on_c2 + tangency
+
+    def _av_tangent_at_lc(self, args):
+        p, l, c = args
+        circ_center = Point(FuncInfo("origin", [c]))
+        circ_center_to_p = Line(FuncInfo("connecting", [circ_center, p]))
+
+        p_on_line = self.assertion_vals("on-line", [p, l])
+        p_on_circ = self.assertion_vals("on-circ", [p, c])
+        tangency = self.assertion_vals("perp", [l, circ_center_to_p])
+        return p_on_line + p_on_circ + tangency
+
+    _PRED_HANDLERS = {
+        "amidp-opp": _av_amidp_opp,
+        "amidp-same": _av_amidp_same,
+        "circumcenter": _av_circumcenter,
+        "coll": _av_coll,
+        "concur": _av_concur,
+        "cong": _av_cong,
+        "con-tri": _av_con_tri,
+        "cycl": _av_cycl,
+        "dist-lt": _av_dist_lt,
+        "dist-gt": _av_dist_gt,
+        "eq-n": _av_eq_n,
+        "eq-p": _av_eq_p,
+        "eq-l": _av_eq_l,
+        "gte": _av_gte,
+        "gt": _av_gt,
+        "lte": _av_lte,
+        "lt": _av_lt,
+        "eq-angle": _av_eq_angle,
+        "eq-ratio": _av_eq_ratio,
+        "foot": _av_foot,
+        "i-bisector": _av_i_bisector,
+        "incenter": _av_incenter,
+        "in-poly": _av_in_poly,
+        "inter-ll": _av_inter_ll,
+        "isogonal-conj": _av_isogonal_conj,
+        "midp": _av_midp,
+        "on-circ": _av_on_circ,
+        "on-line": _av_on_line,
+        "on-ray": _av_on_ray,
+        "on-seg": _av_on_seg,
+        "opp-sides": _av_opp_sides,
+        "orthocenter": _av_orthocenter,
+        "perp": _av_perp,
+        "para": _av_para,
+        "reflect-pl": _av_reflect_pl,
+        "right": _av_right,
+        "right-tri": _av_right_tri,
+        "same-side": _av_same_side,
+        "sim-tri": _av_sim_tri,
+        "tangent-cc": _av_tangent_cc,
+        "tangent-lc": _av_tangent_lc,
+        "tangent-at-cc": _av_tangent_at_cc,
+        "tangent-at-lc": _av_tangent_at_lc,
+    }
 
 
     #####################
@@ -1013,6 +1254,11 @@ class Optimizer(ABC):
         b1, b2 = B
         return a1*b1 + a2*b2
 
+    def foot_on_line(self, O, A, B):
+        # Projection of O onto line AB
+        AB = B - A
+        return A + AB.smul(self.inner_product(O - A, AB) / self.inner_product(AB, AB))
+
     def scalar_product(self, A, O, B):
         lhs = (A.x - O.x) * (B.x - O.x)
         rhs = (A.y - O.y) * (B.y - O.y)
@@ -1031,19 +1277,19 @@ class Optimizer(ABC):
         return self.matrix_mul(self.rotation_matrix(theta), pt)
 
     def rotate_clockwise_90(self, pt):
-        return self.matrix_mul(
-            (self.get_point(self.const(0.0), self.const(1.0)),
-             self.get_point(self.const(-1.0),self.const(0.0))),
-            pt)
+        return self.get_point(pt.y, -pt.x)
 
     def rotate_counterclockwise_90(self, pt):
-        return self.matrix_mul(
-            (self.get_point(self.const(0.0), self.const(-1.0)),
-             self.get_point(self.const(1.0),self.const(0.0))),
-            pt)
+        return self.get_point(-pt.y, pt.x)
 
+    @memoize
+    def sqside_lengths(self, A, B, C):
+        return self.sqdist(B, C), self.sqdist(C, A), self.sqdist(A, B)
+
+    @memoize
     def side_lengths(self, A, B, C):
-        return self.dist(B, C), self.dist(C, A), self.dist(A, B)
+        a2, b2, c2 = self.sqside_lengths(A, B, C)
+        return self.sqrt(a2), self.sqrt(b2), self.sqrt(c2)
 
     def clockwise_angle(self, A, B, C):
         x1, y1 = A.x - B.x, A.y - B.y
@@ -1053,16 +1299,31 @@ class Optimizer(ABC):
         det = x1 * y2 - y1 * x2
         return self.atan2(det, dot)
 
-    def angle(self, A, B, C):
-        a, b, c = self.side_lengths(A, B, C)
-        return self.acos((a**2 + c**2 - b**2) / (2 * a * c))
+    def angle(self, A, B, C, inv=None):
+        if inv is None:
+            inv = self.triangle_invariants(A, B, C)
+        return self.acos(inv.Sb / self.sqrt(inv.a2 * inv.c2))
 
     def right_phi(self, A, B, C):
         return self.abs(self.angle(A, B, C) - math.pi / 2)
 
-    def conway_vals(self, A, B, C):
+    @memoize
+    def triangle_invariants(self, A, B, C):
         a, b, c = self.side_lengths(A, B, C)
-        return (b**2 + c**2 - a**2)/2, (c**2 + a**2 - b**2)/2, (a**2 + b**2 - c**2)/2
+        a2, b2, c2 = self.sqside_lengths(A, B, C)
+        Sa, Sb, Sc = (b2 + c2 - a2)/2, (c2 + a2 - b2)/2, (a2 + b2 - c2)/2
+        return TriangleInvariants(a, b, c, a2, b2, c2, Sa, Sb, Sc)
+
+    def conway_vals(self, A, B, C, inv=None):
+        if inv is None:
+            inv = self.triangle_invariants(A, B, C)
+        return inv.Sa, inv.Sb, inv.Sc
+
+    def cosines(self, A, B, C, inv=None):
+        # Law of cosines: cosines of the angles at A, B and C
+        if inv is None:
+            inv = self.triangle_invariants(A, B, C)
+        return inv.Sa / (inv.b * inv.c), inv.Sb / (inv.c * inv.a), inv.Sc / (inv.a * inv.b)
 
     def trilinear(self, A, B, C, x, y, z):
         a, b, c = self.side_lengths(A, B, C)
@@ -1071,25 +1332,30 @@ class Optimizer(ABC):
                               (a * x * A.y + b * y * B.y + c * z * C.y) / denom)
 
     def barycentric(self, A, B, C, x, y, z):
-        a, b, c = self.side_lengths(A, B, C)
-        return self.trilinear(A, B, C, x/a, y/b, z/c)
-
-    def circumcenter(self, A, B, C):
-        a, b, c = self.side_lengths(A, B, C)
-        Sa, Sb, Sc = self.conway_vals(A, B, C)
-        res = self.barycentric(A, B, C, a**2 * Sa, b**2 * Sb, c**2 * Sc)
-        return res
-
-    def orthocenter(self, A, B, C):
-        a, b, c = self.side_lengths(A, B, C)
-        Sa, Sb, Sc = self.conway_vals(A, B, C)
+        return (A.smul(x) + B.smul(y) + C.smul(z)).sdiv(x + y + z)
+
+    @memoize
+    def circumcenter(self, A, B, C, inv=None):
+        if inv is None:
+            inv = self.triangle_invariants(A, B, C)
+        return self.barycentric(A, B, C, inv.a2 * inv.Sa, inv.b2 * inv.Sb, inv.c2 * inv.Sc)
+
+    @memoize
+    def orthocenter(self, A, B, C, inv=None):
+        if inv is None:
+            inv = self.triangle_invariants(A, B, C)
+        Sa, Sb, Sc = inv.Sa, inv.Sb, inv.Sc
         return self.barycentric(A, B, C, Sb * Sc, Sc * Sa, Sa * Sb)
 
     def centroid(self, A, B, C):
-        return self.barycentric(A, B, C, 1, 1, 1)
+        return (A + B + C).smul(1 / 3)
 
-    def incenter(self, A, B, C):
-        return self.trilinear(A, B, C, 1, 1, 1)
+    @memoize
+    def incenter(self, A, B, C, inv=None):
+        if inv is None:
+            inv = self.triangle_invariants(A, B, C)
+        a, b, c = inv.a, inv.b, inv.c
+        return (A.smul(a) + B.smul(b) + C.smul(c)).sdiv(a + b + c)
 
     def excenter(self, A, B, C):
         return self.trilinear(A, B, C, -1, 1, 1)
@@ -1136,24 +1402,18 @@ class Optimizer(ABC):
         return self.gt(self.side_score_prod(a, b, x, y), 0.0)
 
     def inter_ll(self, l1, l2):
+        # Cramer's rule on n1 . X = r1, n2 . X = r2 (n1, n2 are unit vectors)
         (n11, n12), r1 = l1 # TODO(jesse): ensure that this pattern matching works
         (n21, n22), r2 = l2
 
-        def inter_ll_aux(n11, n12, r1, n21, n22, r2):
-            numer = n11 * r2 * (n21 ** 2 + n22**2) - r1 * (n11**2 * n21 + n12**2 * n21)
-            denom = n11 * n22 - n12 * n21
-            def on_ok():
-                return numer/denom
-
-            def on_bad():
-                return numer/(tf.math.sign(denom) * 1e-4)
+        det = n11 * n22 - n12 * n21
+        # Nearly parallel lines: clamp |det| to 1e-4, keeping its sign
+        det = self.cond(self.lt(self.abs(det), 1e-4),
+                        lambda: self.sign(det) * 1e-4,
+                        lambda: det)
 
-            return tf.cond(tf.less(tf.math.abs(denom), 1e-4),
-                           on_bad,
-                           on_ok)
-
-        return self.get_point(x=inter_ll_aux(n22, n21, r2, n12, n11, r1),
-                              y=inter_ll_aux(n11, n12, r1, n21, n22, r2))
+        return self.get_point(x=(r1 * n22 - r2 * n12) / det,
+                              y=(n11 * r2 - n21 * r1) / det)
 
     def inter_pp_c(self, P1, P2, cnf):
         # We follow http://mathworld.wolfram.com/Circle-LineIntersection.html
@@ -1163,28 +1423,29 @@ class Optimizer(ABC):
         dx = P1.x - P2.x
         dy = P1.y - P2.y
 
-        dr = self.sqrt(dx**2 + dy**2)
+        dr2 = dx**2 + dy**2
         D = P2.x * P1.y - P1.x * P2.y
 
-        radicand = r**2 * dr**2 - D**2
+        radicand = r**2 * dr2 - D**2
 
         def on_nneg():
-            def sgnstar(x):
-                return self.cond(self.lt(x, self.const(0.0)), lambda: self.const(-1.0), lambda: self.const(1.0))
-
-            Q1 = self.get_point((D * dy + sgnstar(dy) * dx * self.sqrt(radicand)) / (dr**2),
-                                (-D * dx + self.abs(dy) * self.sqrt(radicand)) / (dr**2))
+            sqrt_radicand = self.sqrt(radicand)
+            x_off = self.sgnstar(dy) * dx * sqrt_radicand
+            y_off = self.abs(dy) * sqrt_radicand
 
-            Q2 = self.get_point((D * dy - sgnstar(dy) * dx * self.sqrt(radicand)) / (dr**2),
-                                (-D * dx - self.abs(dy) * self.sqrt(radicand)) / (dr**2))
-            return self.unshift(O, [Q1, Q2])
+            # Both roots are the foot of the chord plus/minus the same offset,
+            # so only the foot needs to be shifted back
+            M = O + self.get_point(D * dy / dr2, -D * dx / dr2)
+            off = self.get_point(x_off / dr2, y_off / dr2)
+            return [M + off, M - off]
 
         def on_neg():
-            Operp = self.rotate_counterclockwise_90(P1 - P2) + O
-            F = self.inter_ll(self.pp2lnf(P1, P2), self.pp2lnf(O, Operp))
-            X = O + (F - O).smul(r / self.dist(O, F))
-            Q = self.midp(F, X)
-            return self.unshift(O, [Q, Q])
+            # P1, P2 are already shifted, so the center is the origin here
+            origin = self.get_point(self.const(0.0), self.const(0.0))
+            F = self.foot_on_line(origin, P1, P2)
+            X = F.smul(r / self.dist(origin, F))
+            Q = O + self.midp(F, X)
+            return [Q, Q]
 
         return self.cond(self.lte(radicand, self.const(0.0)), on_neg, on_nneg)
 
@@ -1201,14 +1462,14 @@ class Optimizer(ABC):
     def make_lc_intersect(self, name, lnf, c):
         A, B = self.lnf2pp(lnf)
         O, r = c
-        Operp = self.rotate_counterclockwise_90(A - B) + O
 
-        F = self.inter_ll(lnf, self.pp2lnf(O, Operp))
+        F = self.foot_on_line(O, A, B)
+        # For tangent lines r == d up to rounding, so compare d itself rather
+        # than squares to keep the same side of that boundary
         d = self.dist(O, F)
         f_val = self.cond(self.lt(r, d), lambda: d, lambda: self.const(0.0))
 
-        loss = self.cond(self.logical_or(self.lt(self.dist(O, Operp), 1e-6),
-                                         self.lt(self.dist(A, B), 1e-6)),
+        loss = self.cond(self.lt(self.sqdist(A, B), 1e-12),
                          lambda: self.const(0.0), lambda: f_val)
         self.register_loss(f"interLC_{name}", loss, weight=1e-1)
 
@@ -1217,13 +1478,14 @@ class Optimizer(ABC):
         return self.cond(self.lt(self.sqdist(A, P1), self.sqdist(A, P2)), lambda: P2, lambda: P1)
 
     def amidp_opp(self, B, C, A):
-        O = self.circumcenter(A, B, C)
-        I = self.incenter(A, B, C)
+        inv = self.triangle_invariants(A, B, C)
+        O = self.circumcenter(A, B, C, inv=inv)
+        I = self.incenter(A, B, C, inv=inv)
         return self.second_meet_pp_c(A, I, O)
 
     def amidp_same(self, B, C, A):
         M = self.amidp_opp(B, C, A)
-        O = self.circumcenter(A, B, C)
+        O = self.circumcenter(A, B, C, inv=self.triangle_invariants(A, B, C))
         return self.second_meet_pp_c(M, O, O)
 
 
@@ -1247,17 +1509,38 @@ class Optimizer(ABC):
 
         return p1, p2
 
+    @memoize
     def radical_axis(self, cnf1, cnf2):
         p1, p2 = self.radical_axis_pts(cnf1, cnf2)
         return self.pp2lnf(p1, p2)
 
+    @memoize
     def eqangle6_diff(self, A, B, C, P, Q, R):
         s1 = self.det3(A, B, C)
         c1 = self.scalar_product(A, B, C)
         s2 = self.det3(P, Q, R)
         c2 = self.scalar_product(P, Q, R)
+        return self.eqangle_diff(s1, c1, s2, c2)
+
+    def eqangle_diff(self, s1, c1, s2, c2):
+        # Angles given by (scaled) sines and cosines
         return 0.1 * (s1 * c2 - s2 * c1)
 
+    @memoize
+    def triangle_edge_terms(self, A, B, C):
+        # The angle at B is between -(B - A) and C - B; negating both edges
+        # flips both its sine and cosine, which cancels in eqangle_diff
+        edges = [B - A, C - B, A - C]
+        E = self.stack_pts(edges)
+        F = self.stack_pts(edges[1:] + edges[:1])
+        return TriangleEdgeTerms(sins=E.x * F.y - E.y * F.x,
+                                 coss=E.x * F.x + E.y * F.y,
+                                 sqs=E.x ** 2 + E.y ** 2)
+
+    def eqangle6_diff_batch(self, Ps, idxs):
+        # Each row of idxs holds the positions in Ps of one (A, B, C, P, Q, R)
+        return self.eqangle6_diff(*self.gather_pts(Ps, idxs))
+
     def eqratio_diff(self, A, B, C, D, P, Q, R, S):
         # AB/CD = PQ/RS
         return self.sqrt(self.dist(A, B) * self.dist(R, S)) - self.sqrt(self.dist(P, Q) * self.dist(C, D))
@@ -1268,63 +1551,72 @@ class Optimizer(ABC):
     def eqangle8_diff(self, A, B1, B2, C, P, Q1, Q2, R):
         return self.eqangle6_diff(A, B1, C - B2 + B1, P, Q1, R - Q2 + Q1)
 
-    def semiperimeter(self, A, B, C):
+    @memoize
+    def _abc_s(self, A, B, C):
+        # Side lengths and semiperimeter
         a, b, c = self.side_lengths(A, B, C)
-        return (a + b + c) / 2
+        return a, b, c, (a + b + c) / 2
 
+    def semiperimeter(self, A, B, C):
+        return self._abc_s(A, B, C)[3]
+
+    @memoize
     def area(self, A, B, C):
-        a, b, c = self.side_lengths(A, B, C)
-        s = self.semiperimeter(A, B, C)
-        return self.sqrt(s * (s - a) * (s - b) * (s - c))
+        # Half the cross product: unlike Heron's formula this does not cancel
+        # catastrophically for sliver triangles and needs no sqrt
+        return self.abs(self.det3(A, B, C)) / 2
 
     def inradius(self, A, B, C):
         return self.area(A, B, C) / self.semiperimeter(A, B, C)
 
     def exradius(self, A, B, C):
-        r = self.inradius(A, B, C)
-        a, b, c = self.side_lengths(A, B, C)
-        s = (a + b + c)/2
-        return r * s / (s - a)
+        # r * s / (s - a) with r = area / s
+        a, b, c, s = self._abc_s(A, B, C)
+        return self.area(A, B, C) / (s - a)
 
     def mixtilinear_incenter(self, A, B, C):
-        ta, tb, tc = self.angle(C, A, B), self.angle(A, B, C), self.angle(B, C, A)
-        return self.trilinear(A, B, C, (1/2) * (1 + self.cos(ta) - self.cos(tb) - self.cos(tc)), 1, 1)
+        cos_a, cos_b, cos_c = self.cosines(A, B, C)
+        return self.trilinear(A, B, C, (1/2) * (1 + cos_a - cos_b - cos_c), 1, 1)
 
     def mixtilinear_inradius(self, A, B, C):
         r = self.inradius(A, B, C)
-        ta = self.angle(C, A, B)
-        return r * (1 / self.cos(ta / 2)**2)
+        cos_a, _, _ = self.cosines(A, B, C)
+        # 1 / cos(A/2)^2 = 2 / (1 + cos A)
+        return r * 2 / (1 + cos_a)
 
 
+    @memoize
     def to_trilinear(self, P, A, B, C):
-        la = self.pp2lnf(B, C)
-        lb = self.pp2lnf(C, A)
-        lc = self.pp2lnf(A, B)
-
-        ga = self.pp2lnf(P, P + self.rotate_counterclockwise_90(C - B))
-        gb = self.pp2lnf(P, P + self.rotate_counterclockwise_90(A - C))
-        gc = self.pp2lnf(P, P + self.rotate_counterclockwise_90(B - A))
-
-        da = self.dist(P, self.inter_ll(la, ga))
-        db = self.dist(P, self.inter_ll(lb, gb))
-        dc = self.dist(P, self.inter_ll(lc, gc))
-
-        da = self.cond(self.opp_sides(P, A, B, C), lambda: -da, lambda: da)
-        db = self.cond(self.opp_sides(P, B, C, A), lambda: -db, lambda: db)
-        dc = self.cond(self.opp_sides(P, C, A, B), lambda: -dc, lambda: dc)
+        # Signed distances from P to the sides, positive on the side of the
+        # opposite vertex. det3 is invariant under cyclic shifts, so
+        # det3(A, B, C) = det3(B, C, A) = det3(C, A, B) gives the orientation.
+        a, b, c = self.side_lengths(A, B, C)
+        orient = self.sgnstar(self.det3(A, B, C))
+        da = orient * self.det3(P, B, C) / a
+        db = orient * self.det3(P, C, A) / b
+        dc = orient * self.det3(P, A, B) / c
         return da, db, dc
 
     def invert_or_zero(self, x):
-        return self.cond(self.abs(x) < 1e-5, lambda: self.const(0.0), lambda: self.const(1) / x)
+        # 1 / x, or 0 when |x| < 1e-5. sign(x) / |x| with a clamped |x| keeps
+        # the value and its gradient finite without a cond.
+        ax = self.abs(x)
+        keep = self.max(self.const(0.0), self.sign(ax - 1e-5))
+        return keep * self.sign(x) / self.max(ax, self.const(1e-5))
+
+    @memoize
+    def inverted_trilinear(self, P, A, B, C):
+        # Shared by the isogonal and isotomic conjugates of the same point
+        return [self.invert_or_zero(t) for t in self.to_trilinear(P, A, B, C)]
 
     def isogonal_conj(self, P, A, B, C):
-        x, y, z = self.to_trilinear(P, A, B, C)
-        return self.trilinear(A, B, C, self.invert_or_zero(x), self.invert_or_zero(y), self.invert_or_zero(z))
+        x, y, z = self.inverted_trilinear(P, A, B, C)
+        return self.trilinear(A, B, C, x, y, z)
 
     def isotomic_conj(self, P, A, B, C):
-        a, b, c = self.side_lengths(A, B, C)
-        x, y, z = self.to_trilinear(P, A, B, C)
-        return self.trilinear(A, B, C, (a**2) * self.invert_or_zero(x), (b**2) * self.invert_or_zero(y), (c**2) * self.invert_or_zero(z))
+        a2, b2, c2 = self.sqside_lengths(A, B, C)
+        x, y, z = self.inverted_trilinear(P, A, B, C)
+        return self.trilinear(A, B, C, a2 * x, b2 * y, c2 * z)
 
 
     def inverse(self, X, O, A):
@@ -1334,7 +1626,7 @@ class Optimizer(ABC):
         # see picture in https://en.wikipedia.org/wiki/Projective_harmonic_conjugate
         # L is arbitrary here, not on the line X A B
         # (could also do case analysis and cross-ratio)
-        L = A + self.rotate_counterclockwise(self.const(math.pi / 3), X - A).smul(0.5)
+        L = A + self.matrix_mul(HALF_ROTATION_60, X - A)
         M = self.midp(A, L)
         N = self.inter_ll(self.pp2lnf(B, L), self.pp2lnf(X, M))
         K = self.inter_ll(self.pp2lnf(A, N), self.pp2lnf(B, M))
@@ -1342,19 +1634,19 @@ class Optimizer(ABC):
         return Y
 
     def in_poly_phis(self, X, *Ps):
-        phis = []
         n = len(Ps)
-        for i in range(n):
-            A, B, C = Ps[i], Ps[(i+1) % n], Ps[(i+2) % n]
-            # X and C are on the same side of AB
-            phis.append(self.max(self.const(0.0), - self.side_score_prod(X, C, A, B)))
-        return phis
+        # Row i holds i, i+1, i+2 (mod n): every window of consecutive vertices
+        idxs = (np.arange(n)[:, None] + np.arange(3)) % n
+        A, B, C = self.gather_pts(Ps, idxs)
+        # X and C are on the same side of AB
+        return [self.max(self.const(0.0), - self.side_score_prod(X, C, A, B))]
 
 
     #####################
     ## Utilities
     ####################
 
+    @memoize_by_value
     def line2twoPts(self, l):
         if isinstance(l.val, str):
             L = self.name2line[l]
@@ -1405,8 +1697,7 @@ class Optimizer(ABC):
                 # B, C, D, E, F = self.lookup_pts(args)
                 # theta = self.angle(D, E, F)
                 # X = B + self.rotate_counterclockwise(theta, C - B)
-                # # self.segments.extend([(A, B), (B, C), (P, Q), (Q, R)])
-                return B, X
+                # return B, X
             elif pred == "reflect-ll":
                 l1, l2 = args
                 lnf1 = self.line2nf(l1)
@@ -1434,55 +1725,47 @@ class Optimizer(ABC):
         m = self.rotate_clockwise_90(n)
         return w, w + m
 
+    @memoize
     def pp2lnf(self, p1, p2):
 
         # TODO(jesse): please name this
         def mysterious_pp2pp(p1, p2):
             x,y = p2
             def pred(x,y):
-                return tf.logical_or(tf.math.less(y, self.const(0.0)),
-                                     tf.logical_and(tf.equal(y, self.const(0.0)), tf.math.less(x, self.const(0.0))))
-            return tf.compat.v1.cond(pred(x,y), lambda:(p1, p2.smul(-1.0)), lambda:(p1, p2))
+                return self.logical_or(self.lt(y, self.const(0.0)),
+                                       self.logical_and(self.eq(y, self.const(0.0)), self.lt(x, self.const(0.0))))
+            return self.cond(pred(x,y), lambda:(p1, p2.smul(-1.0)), lambda:(p1, p2))
 
         def pp2lnf_core(p1, p2):
             p1, p2 = mysterious_pp2pp(p1, p2)
             x , _ = p2
-            n = tf.compat.v1.cond(tf.less_equal(x,0.0), lambda: self.rotate_clockwise_90(p2), lambda: self.rotate_counterclockwise_90(p2))
+            n = self.cond(self.lte(x,0.0), lambda: self.rotate_clockwise_90(p2), lambda: self.rotate_counterclockwise_90(p2))
             r = self.inner_product(p1, n)
             return LineNF(n=n, r=r)
 
         return pp2lnf_core(p1, (p1 - p2).normalize())
 
 
+    @memoize_by_value
     def line2nf(self, l):
         if isinstance(l.val, str):
             return self.name2line[l]
+        elif l.val.head == "connecting":
+            # Most common case; skip line2twoPts and its memo lookup
+            p1, p2 = self.lookup_pts(l.val.args)
+            return self.pp2lnf(p1, p2)
         else:
             p1, p2 = self.line2twoPts(l)
             return self.pp2lnf(p1, p2)
 
     def pp2sf(self, p1, p2):
-        def vert_line():
-            return LineSF(self.const(1.0), self.const(0.0), p1.x, p1, p2)
-
-        def horiz_line():
-            return LineSF(self.const(0.0), self.const(1.0), p1.y, p1, p2)
-
-        def calc_sf_from_slope_intercept():
-            (x1, y1) = p1
-            (x2, y2) = p2
-
-            m = (y2 - y1) / (x2 - x1)
-            b = y1 - m * x1
-            # y = mx + b ---> -mx + (1)y = b
-            return LineSF(-m, self.const(1.0), b, p1, p2)
-
-        return self.cond(self.eq(p1.x, p2.x),
-                         vert_line,
-                         lambda: self.cond(self.eq(p1.y, p2.y),
-                                           horiz_line,
-                                           calc_sf_from_slope_intercept))
+        # Implicit form a x + b y = c; no division, so vertical lines need no
+        # special case
+        a = p1.y - p2.y
+        b = p2.x - p1.x
+        return LineSF(a, b, a * p1.x + b * p1.y, p1, p2)
 
+    @memoize_by_value
     def circ2nf(self, circ):
 
         if isinstance(circ.val, str):
@@ -1528,58 +1811,91 @@ class Optimizer(ABC):
     def unshift(self, O, Ps):
         return [self.get_point(P.x + O.x, P.y + O.y) for P in Ps]
 
+    def closer_of(self, P1, P2, pt):
+        # P1 on ties; closer_of(P2, P1, pt) is the one further from pt
+        return self.cond(self.lte(self.sqdist(P1, pt), self.sqdist(P2, pt)), lambda: P1, lambda: P2)
+
     def pt_eq(self, p1, p2):
-        return self.lt(self.dist(p1, p2), 1e-6)
+        return self.lt(self.sqdist(p1, p2), 1e-12)
 
     def pt_neq(self, p1, p2):
-        return self.gt(self.dist(p1, p2), 1e-6)
+        return self.gt(self.sqdist(p1, p2), 1e-12)
 
     def process_rs(self, P1, P2, root_select):
         pred = root_select.pred
-        rs_args = root_select.vars
-        if pred == "neq":
-            [pt] = self.lookup_pts(rs_args)
-            return self.cond(self.pt_neq(P1, pt), lambda: P1, lambda: P2)
-        elif pred == "closer-to-p":
-            [pt] = self.lookup_pts(rs_args)
-            test = self.lte(self.sqdist(P1, pt), self.sqdist(P2, pt))
-            return self.cond(test, lambda: P1, lambda: P2)
-        elif pred == "closer-to-l":
-            [l] = rs_args
-            P1_foot = Point(FuncInfo("foot", [Point(FuncInfo("__val__", [P1])), l]))
-            P1_foot = self.lookup_pt(P1_foot)
-            P2_foot = Point(FuncInfo("foot", [Point(FuncInfo("__val__", [P2])), l]))
-            P2_foot = self.lookup_pt(P2_foot)
-            test = self.lte(self.sqdist(P1, P1_foot), self.sqdist(P2, P2_foot))
-            return self.cond(test, lambda: P1, lambda: P2)
-        # elif pred == "furtherFrom":
-            # [pt] = self.lookup_pts(rs_args)
-            # test = self.lt(self.sqdist(P2, pt), self.sqdist(P1, pt))
-            # return self.cond(test, lambda: P1, lambda: P2)
-        elif pred == "opp-sides":
-            [pt] = self.lookup_pts([rs_args[0]])
-            a, b = self.lnf2pp(self.line2nf(rs_args[1]))
-            return self.cond(self.opp_sides(P1, pt, a, b), lambda: P1, lambda: P2)
-        elif pred == "same-side":
-            [pt] = self.lookup_pts([rs_args[0]])
-            a, b = self.lnf2pp(self.line2nf(rs_args[1]))
-            return self.cond(self.same_side(P1, pt, a, b), lambda: P1, lambda: P2)
-        elif pred == "arbitrary":
-            return P2
-        else:
+        if pred not in self._RS_HANDLERS:
             raise NotImplementedError(f"[process_rs] NYI: {pred}")
+        return self._RS_HANDLERS[pred](self, P1, P2, root_select.vars)
+
+    def _rs_neq(self, P1, P2, rs_args):
+        [pt] = self.lookup_pts(rs_args)
+        return self.cond(self.pt_neq(P1, pt), lambda: P1, lambda: P2)
+
+    def _rs_closer_to_p(self, P1, P2, rs_args):
+        [pt] = self.lookup_pts(rs_args)
+        return self.closer_of(P1, P2, pt)
+
+    def _rs_closer_to_l(self, P1, P2, rs_args):
+        [l] = rs_args
+        a, b = self.lnf2pp(self.line2nf(l))
+        P1_foot = self.foot_on_line(P1, a, b)
+        P2_foot = self.foot_on_line(P2, a, b)
+        test = self.lte(self.sqdist(P1, P1_foot), self.sqdist(P2, P2_foot))
+        return self.cond(test, lambda: P1, lambda: P2)
+
+    # def _rs_further_from(self, P1, P2, rs_args):
+        # [pt] = self.lookup_pts(rs_args)
+        # return self.closer_of(P2, P1, pt)
+
+    def _rs_opp_sides(self, P1, P2, rs_args):
+        [pt] = self.lookup_pts([rs_args[0]])
+        a, b = self.lnf2pp(self.line2nf(rs_args[1]))
+        return self.cond(self.opp_sides(P1, pt, a, b), lambda: P1, lambda: P2)
+
+    def _rs_same_side(self, P1, P2, rs_args):
+        [pt] = self.lookup_pts([rs_args[0]])
+        a, b = self.lnf2pp(self.line2nf(rs_args[1]))
+        return self.cond(self.same_side(P1, pt, a, b), lambda: P1, lambda: P2)
+
+    def _rs_arbitrary(self, P1, P2, rs_args):
+        return P2
+
+    _RS_HANDLERS = {
+        "neq": _rs_neq,
+        "closer-to-p": _rs_closer_to_p,
+        "closer-to-l": _rs_closer_to_l,
+        # "furtherFrom": _rs_further_from,
+        "opp-sides": _rs_opp_sides,
+        "same-side": _rs_same_side,
+        "arbitrary": _rs_arbitrary,
+    }
+
+    def close_pairs(self):
+        # Names of every pair of named points closer than min_dist
+        names = list(self.name2idx)
+        if len(names) < 2:
+            return []
+        xs, ys = self.run([self.pt_xs, self.pt_ys])
+        Ps = PointArray(x=np.array(xs), y=np.array(ys))
+        idxs = combination_idxs(len(names), 2)
+        A, B = [PointArray(x=Ps.x[col], y=Ps.y[col]) for col in idxs.T]
+        min_dist = self.opts['min_dist']
+        close = idxs[self.sqdist(A, B) < min_dist ** 2]
+        return [(names[a], names[b]) for a, b in close]
 
     def points_far_enough_away(self):
-        name2pt = self.run(self.name2pt)
-        min_dist = self.opts['min_dist']
-        for a, b in itertools.combinations(name2pt.keys(), 2):
-            A, B = name2pt[a], name2pt[b]
-            d = self.dist(A, B)
-            if d < min_dist:
-                if self.opts['verbosity'] >= 0:
-                    print(f"DUP: {a} {b}")
-                return False
-        return True
+        close = self.close_pairs()
+        if not close:
+            return True
+        if self.opts['verbosity'] >= 0:
+            for a, b in close:
+                print(f"DUP: {a} {b}")
+        return False
+
+    def sgnstar(self, x):
+        # sign(x), except that sgnstar(0) = 1
+        s = self.sign(x)
+        return s + (1 - self.abs(s))
 
     def diff_signs(self, x, y):
         return self.max(self.const(0.0), x * y)
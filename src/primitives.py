@@ -12,10 +12,21 @@ import pdb
 from util import FuncInfo
 
 
+def hash_key(val):
+    # vals of unnamed primitives hold lists; equal vals give equal keys
+    # (numbers hash by value, so 3 and 3.0 agree as they do under ==)
+    if isinstance(val, (list, tuple)):
+        return tuple(hash_key(v) for v in val)
+    return val
+
 
 class Primitive(ABC):
+    __slots__ = ("val", "_str", "_hash")
+
     def __init__(self, val):
         self.val = val
+        self._str = None
+        self._hash = None
         super().__init__()
 
     def __eq__(self, other):
@@ -27,16 +38,26 @@ class Primitive(ABC):
         return self.val == other.val
 
     def __hash__(self):
-        return hash(self.val)
+        if self._hash is None:
+            self._hash = hash(hash_key(self.val))
+        return self._hash
 
 
-    @abstractmethod
     def __str__(self):
+        # Primitives are never mutated, so the printed form is built once
+        if self._str is None:
+            self._str = self.build_str()
+        return self._str
+
+    @abstractmethod
+    def build_str(self):
         pass
 
 
 class Point(Primitive):
-    def __str__(self):
+    __slots__ = ()
+
+    def build_str(self):
         if isinstance(self.val, str):
             return self.val
         else:
@@ -45,7 +66,9 @@ class Point(Primitive):
 
 
 class Num(Primitive):
-    def __str__(self):
+    __slots__ = ()
+
+    def build_str(self):
         if isinstance(self.val, numbers.Number):
             return str(self.val)
         else:
@@ -53,6 +76,7 @@ class Num(Primitive):
 
 
 class Circle(Primitive):
+    __slots__ = ()
 
     def pointsOn(self):
         pred, points = self.val
@@ -67,7 +91,7 @@ class Circle(Primitive):
         else:
             raise RuntimeError("[Circle.pointsOn] Invalid circle pred")
 
-    def __str__(self):
+    def build_str(self):
         if isinstance(self.val, str):
             return self.val
         elif isinstance(self.val, FuncInfo):
@@ -77,6 +101,7 @@ class Circle(Primitive):
             raise RuntimeError("Invalid circle")
 
 class Line(Primitive):
+    __slots__ = ()
 
     def pointsOn(self):
         pred, points = self.val
@@ -97,7 +122,7 @@ class Line(Primitive):
         else:
             raise RuntimeError("[Line.pointsOn] Invalid line pred")
 
-    def __str__(self):
+    def build_str(self):
         if isinstance(self.val, str):
             return self.val
         elif isinstance(self.val, FuncInfo):
@@ -5,19 +5,20 @@ Authors: Ryan Krueger, Jesse Michael Han, Daniel Selsam
 """
 
 import tensorflow.compat.v1 as tf
-import pdb
 import collections
 import random
-import itertools
 from tqdm import tqdm
 import os
 import glob
 
-from optimizer import Optimizer, LineSF, CircleNF
+from optimizer import Optimizer, LineSF, CircleNF, combination_idxs
 from diagram import Diagram
 from util import get_random_string
 
 class TfPoint(collections.namedtuple("TfPoint", ["x", "y"])):
+    # No per-instance __dict__; points are built for every intermediate vector
+    __slots__ = ()
+
     def __add__(self, p):  return TfPoint(self.x + p.x, self.y + p.y)
     def __sub__(self, p):  return TfPoint(self.x - p.x, self.y - p.y)
     def sdiv(self, z):     return TfPoint(self.x / z, self.y / z)
@@ -111,12 +112,30 @@ class TfOptimizer(Optimizer):
     def logical_or(self, x, y):
         return tf.logical_or(x, y)
 
+    def logical_and(self, x, y):
+        return tf.logical_and(x, y)
+
     def abs(self, x):
         return tf.math.abs(x)
 
+    def sign(self, x):
+        return tf.math.sign(x)
+
     def exp(self, x):
         return tf.math.exp(x)
 
+    def stack(self, xs):
+        return tf.stack(xs)
+
+    def gather(self, xs, idxs):
+        return tf.gather(xs, idxs)
+
+    def reduce_max(self, xs):
+        return tf.reduce_max(xs)
+
+    def reduce_min(self, xs):
+        return tf.reduce_min(xs)
+
     #####################
     ## Tensorflow Utilities
     ####################
@@ -142,6 +161,9 @@ class TfOptimizer(Optimizer):
         self.all_points.append(P_checked)
         if save_name:
             self.name2pt[p] = P_checked
+            self.name2idx[p] = len(self.pt_xs)
+            self.pt_xs.append(Px)
+            self.pt_ys.append(Py)
         return P_checked
 
     def register_line(self, l, L):
@@ -182,15 +204,24 @@ class TfOptimizer(Optimizer):
         if negate:
             self.goals[key] = self.mk_non_zero(val)
         else:
-            self.goals[key] = self.mk_zero(val)
+            # Batched assertions (coll, cycl, ...) give a vector of terms;
+            # the goal only holds if the worst of them does
+            self.goals[key] = tf.reduce_max(val**2)
 
     def regularize_points(self):
-        norms = tf.cast([p.norm() for p in self.name2pt.values()], dtype=tf.float64)
+        if not self.pt_xs:
+            return
+        Ps = self.named_pts()
+        norms = tf.math.sqrt(Ps.x ** 2 + Ps.y ** 2)
         self.register_loss("points", tf.reduce_mean(norms), self.opts['regularize_points'])
 
     def make_points_distinct(self):
+        if len(self.pt_xs) < 2:
+            return
         if random.random() < self.opts['distinct_prob']:
-            distincts = tf.cast([self.dist(A, B) for A, B in itertools.combinations(self.name2pt.values(), 2)], tf.float64)
+            idxs = combination_idxs(len(self.pt_xs), 2)
+            A, B = self.gather_pts(self.named_pts(), idxs)
+            distincts = self.dist(A, B)
             dloss     = tf.reduce_mean(self.mk_non_zero(distincts))
             self.register_loss("distinct", dloss, self.opts['make_distinct'])
 